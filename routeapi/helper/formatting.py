@@ -0,0 +1,12 @@
+def seconds_to_time(seconds):
+    hours = seconds // 3600
+    minutes = (seconds % 3600)//60
+    return f"{hours: 02d}:{minutes:02d}"
+
+
+def format_travel_time(seconds):
+    return f"{seconds//60}min" if seconds < 3600 else f"{seconds//3600}h {(seconds % 3600)//60}m"
+
+
+def meters_to_miles(meters):
+    return round(meters/1600, 2)
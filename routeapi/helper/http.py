@@ -0,0 +1,59 @@
+import hashlib
+import json
+from django.http import HttpResponse, HttpResponseNotModified
+from .serializer import json_serialize
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+def parse_fields(request):
+    raw = request.GET.get('fields', '')
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    return fields or None
+
+
+def parse_page(request):
+    try:
+        page = int(request.GET.get('page', 1))
+        page_size = int(request.GET.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("page and page_size must be integers")
+    if page < 1 or page_size < 1:
+        raise ValueError("page and page_size must be positive")
+    return page, min(page_size, MAX_PAGE_SIZE)
+
+
+def project(document, fields):
+    if not fields:
+        return document
+    return {field: document[field] for field in fields if field in document}
+
+
+def paginate(items, page, page_size):
+    start = (page - 1) * page_size
+    return {
+        'results': items[start:start + page_size],
+        'page': page,
+        'page_size': page_size,
+        'has_next': len(items) > start + page_size,
+    }
+
+
+def _etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def etag_json_response(request, payload, status=200):
+    body = json.dumps(json_serialize(payload), separators=(',', ':')).encode()
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    if _etag_matches(request.headers.get('If-None-Match'), etag):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json', status=status)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
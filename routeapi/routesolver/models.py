@@ -1,9 +1,9 @@
 from django.db import models
-from routeapi.utils.db import get_mongo_connection
-db = get_mongo_connection()
+from routeapi.utils.db import LazyCollection
 
-routesolver_collection = db['routesolver']
-orders_collection = db['invoices']
-customer_collection = db['customers']
-vehicle_collection = db['vehicleNames']
-cancelled_invoices = db['customerCancelledInvoicesDay']
\ No newline at end of file
+routesolver_collection = LazyCollection('routesolver')
+orders_collection = LazyCollection('invoices')
+customer_collection = LazyCollection('customers')
+vehicle_collection = LazyCollection('vehicleNames')
+cancelled_invoices = LazyCollection('customerCancelledInvoicesDay')
+customer_snaps = LazyCollection('customerRoadSnaps')
\ No newline at end of file
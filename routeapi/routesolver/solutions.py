@@ -0,0 +1,87 @@
+from .models import customer_collection
+from ..helper.formatting import seconds_to_time, format_travel_time, meters_to_miles
+
+# solutions are stored as integer seconds/metres with customer references and
+# rendered to the presentation strings when read
+SOLUTION_FORMAT_VERSION = 2
+CUSTOMER_RENDER_FIELDS = {'customer_name': 1, 'address': 1, 'latitude': 1, 'longitude': 1}
+
+
+def is_compact(solution):
+    return solution.get('format_version', 1) >= SOLUTION_FORMAT_VERSION
+
+
+def load_customers(stops):
+    customer_ids = {stop['customer_id'] for stop in stops if 'customer_id' in stop and 'arrival_s' in stop}
+    if not customer_ids:
+        return {}
+    return {str(cust['_id']): cust
+            for cust in customer_collection.find({'_id': {'$in': list(customer_ids)}}, CUSTOMER_RENDER_FIELDS)}
+
+
+def render_stop(stop, depot_location, customers):
+    if 'arrival_s' not in stop:
+        return stop
+    rendered = {
+        'type': stop['type'],
+        'arrival_time': seconds_to_time(stop['arrival_s']),
+        'departure_time': seconds_to_time(stop['departure_s']),
+        'travel_time': format_travel_time(stop['travel_s']),
+        'distance': meters_to_miles(stop['distance_m']),
+    }
+    if stop['type'] == 'depot':
+        rendered['location'] = f"{depot_location[0]},{depot_location[1]}"
+        rendered['address'] = stop.get('address', "Depot Location")
+        return rendered
+    customer = customers.get(str(stop['customer_id']), {})
+    rendered.update({
+        'order_id': stop.get('order_id'),
+        'original_order_ids': stop.get('original_order_ids', []),
+        'customer_id': stop['customer_id'],
+        'customer_name': customer.get('customer_name'),
+        'address': customer.get('address'),
+        'location': f"{customer.get('latitude')},{customer.get('longitude')}",
+        'order_weight': stop.get('order_weight'),
+    })
+    return rendered
+
+
+def render_route(route, depot_location, customers):
+    rendered = {key: value for key, value in route.items() if key not in ('distance_m', 'total_weight_kg', 'stops')}
+    if 'distance_m' in route:
+        rendered['distance_veh_km'] = meters_to_miles(route['distance_m'])
+    if 'total_weight_kg' in route:
+        rendered['total_weight_kg_veh'] = route['total_weight_kg']
+    if 'stops' in route:
+        rendered['stops'] = [render_stop(stop, depot_location, customers) for stop in route['stops']]
+    return rendered
+
+
+def render_solution(solution, customers=None):
+    if not is_compact(solution):
+        return solution
+    routes = solution.get('vehicle_routes')
+    if customers is None and routes:
+        customers = load_customers([stop for route in routes for stop in route.get('stops', [])])
+    rendered = {key: value for key, value in solution.items()
+                if key not in ('format_version', 'total_distance_m', 'depot_location', 'vehicle_routes')}
+    if 'total_distance_m' in solution:
+        rendered['total_distance'] = meters_to_miles(solution['total_distance_m'])
+    if routes is not None:
+        depot_location = solution.get('depot_location')
+        rendered['vehicle_routes'] = [render_route(route, depot_location, customers or {}) for route in routes]
+    return rendered
+
+
+def stored_projection(fields):
+    # maps rendered field names onto the stored fields they are built from
+    if not fields:
+        return None
+    projection = {'format_version': 1}
+    for field in fields:
+        projection[field] = 1
+        if field == 'total_distance':
+            projection['total_distance_m'] = 1
+        elif field == 'vehicle_routes':
+            projection['depot_location'] = 1
+    return projection
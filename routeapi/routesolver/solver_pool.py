@@ -0,0 +1,202 @@
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context, shared_memory
+from django.conf import settings
+import numpy as np
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_last_used = 0.0
+_recycled = True
+_reaper = None
+_slots = None
+
+
+def _warm_worker():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'routeapp.settings')
+    # load OR-Tools and the solver module once per worker instead of per solve
+    from ortools.constraint_solver import pywrapcp
+    from . import vrp_service
+    pywrapcp.DefaultRoutingSearchParameters()
+
+
+def _ready():
+    return os.getpid()
+
+
+def _create_pool():
+    size = settings.SOLVER_POOL_SIZE
+    pool = ProcessPoolExecutor(
+        max_workers=size,
+        mp_context=get_context('spawn'),
+        initializer=_warm_worker,
+        max_tasks_per_child=settings.SOLVER_POOL_MAX_TASKS_PER_CHILD or None,
+    )
+    # workers are spawned on demand, one per task that finds no idle worker
+    for _ in range(size):
+        pool.submit(_ready)
+    logger.info(f"started solver pool with {size} workers")
+    return pool
+
+
+def _recycle_if_idle(idle_timeout):
+    global _pool, _recycled
+    retired = None
+    with _pool_lock:
+        if _pool is not None and not _recycled and time.monotonic() - _last_used > idle_timeout:
+            retired, _pool = _pool, _create_pool()
+            _recycled = True
+    if retired is not None:
+        logger.info("recycled idle solver workers")
+        retired.shutdown(wait=False)
+    return retired is not None
+
+
+def _reap_idle_pool():
+    idle_timeout = settings.SOLVER_POOL_IDLE_TIMEOUT_SECONDS
+    while True:
+        time.sleep(max(idle_timeout / 4, 1))
+        _recycle_if_idle(idle_timeout)
+
+
+def _forget_parent_pool():
+    # a forked web worker inherits the master's pool object, but its manager thread and
+    # processes stay with the master, so anything submitted to it would never complete
+    global _pool, _pool_pid, _pool_lock, _reaper, _slots
+    _pool = None
+    _pool_pid = None
+    _reaper = None
+    _slots = None
+    _pool_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_parent_pool)
+
+
+def get_pool():
+    global _pool, _pool_pid, _last_used, _recycled, _reaper, _slots
+    with _pool_lock:
+        if _pool is not None and _pool_pid != os.getpid():
+            _pool = None
+            _reaper = None
+            _slots = None
+        if _pool is None:
+            _pool = _create_pool()
+            _pool_pid = os.getpid()
+        if _reaper is None and settings.SOLVER_POOL_IDLE_TIMEOUT_SECONDS:
+            _reaper = threading.Thread(target=_reap_idle_pool, name='solver-pool-reaper', daemon=True)
+            _reaper.start()
+        _last_used = time.monotonic()
+        _recycled = False
+        return _pool
+
+
+def prewarm():
+    if settings.SOLVER_POOL_SIZE > 0:
+        get_pool()
+
+
+def _worker_slots():
+    # one permit per worker, so a submitted solve starts at once and the result timeout
+    # only bounds the solve itself, never the time spent queued behind other plans
+    global _slots
+    with _pool_lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(settings.SOLVER_POOL_SIZE)
+        return _slots
+
+
+def _discard_pool(pool):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+            # permits held by stuck workers of the old pool are never returned
+            _slots = None
+    pool.shutdown(wait=False)
+
+
+def _share(arrays):
+    blocks = []
+    specs = {}
+    try:
+        for name, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            blocks.append(block)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+            specs[name] = (block.name, array.shape, array.dtype.str)
+    except Exception:
+        _release(blocks)
+        raise
+    return blocks, specs
+
+
+def _release(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _attach(specs):
+    arrays = {}
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        try:
+            # the callbacks index plain lists, which is much faster than numpy scalars
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf).tolist()
+        finally:
+            block.close()
+    return arrays
+
+
+def _solve_in_worker(solver, specs, inputs):
+    return solver.solve_vrp(**_attach(specs), **inputs)
+
+
+def solve(solver, distance_matrix, time_matrix, slot_matrices=None, **inputs):
+    if settings.SOLVER_POOL_SIZE <= 0:
+        return _solve_in_process(solver, distance_matrix, time_matrix, slot_matrices, inputs)
+    arrays = {
+        'distance_matrix': np.asarray(distance_matrix, dtype=np.int32),
+        'time_matrix': np.asarray(time_matrix, dtype=np.int32),
+    }
+    if slot_matrices is not None:
+        arrays['slot_matrices'] = slot_matrices
+    slots = _worker_slots()
+    slots.acquire()
+    try:
+        pool = get_pool()
+        blocks, specs = _share(arrays)
+    except BaseException:
+        slots.release()
+        raise
+    try:
+        future = pool.submit(_solve_in_worker, solver, specs, inputs)
+        future.add_done_callback(lambda _: slots.release())
+        return future.result(timeout=settings.SOLVER_POOL_RESULT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        # the worker is stuck in this solve; running it again here would only stack another one
+        logger.error("solver worker did not finish in time, replacing the pool")
+        _discard_pool(pool)
+        raise TimeoutError("solver did not finish in time")
+    except BrokenProcessPool:
+        logger.exception("solver pool is broken, solving in process")
+        _discard_pool(pool)
+        return _solve_in_process(solver, distance_matrix, time_matrix, slot_matrices, inputs)
+    finally:
+        _release(blocks)
+
+
+def _solve_in_process(solver, distance_matrix, time_matrix, slot_matrices, inputs):
+    return solver.solve_vrp(
+        distance_matrix=np.asarray(distance_matrix).tolist(),
+        time_matrix=np.asarray(time_matrix).tolist(),
+        slot_matrices=slot_matrices.tolist() if slot_matrices is not None else None,
+        **inputs,
+    )
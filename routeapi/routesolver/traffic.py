@@ -0,0 +1,78 @@
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+import hashlib
+import json
+import logging
+import threading
+import numpy as np
+
+logger = logging.getLogger(__name__)
+SLOT_CACHE_SIZE = 8
+INT16_MAX = np.iinfo(np.int16).max
+_slot_cache = OrderedDict()
+_slot_cache_lock = threading.Lock()
+
+
+def slot_starts(slots):
+    return [
+        (datetime.strptime(slot['start'], "%H:%M") - datetime.strptime("00:00", "%H:%M")).seconds
+        for slot in slots
+    ]
+
+
+def slot_for(seconds, starts):
+    # starts are sorted; times before the first slot belong to the last one of the previous day
+    return (bisect_right(starts, seconds % 86400) - 1) % len(starts)
+
+
+def to_minutes(durations):
+    # int16 minutes keep a 1000-node profile at 2MB. Rounding up never understates a leg but
+    # overstates it by up to 59s, so only slots with their own OSRM profile are stored this way;
+    # factor slots scale the second-resolution base durations inside the solver
+    minutes = np.ceil(np.asarray(durations, dtype=np.float64) / 60)
+    return np.clip(minutes, 0, INT16_MAX).astype(np.int16)
+
+
+def cache_key(locations, osrm_url):
+    digest = hashlib.sha1()
+    digest.update(np.asarray(locations, dtype=np.float64).tobytes())
+    digest.update(osrm_url.encode())
+    return digest.hexdigest()
+
+
+def cached_profile(locations, osrm_url):
+    key = cache_key(locations, osrm_url)
+    with _slot_cache_lock:
+        if key in _slot_cache:
+            _slot_cache.move_to_end(key)
+            return _slot_cache[key]
+    return None
+
+
+def cache_profile(locations, osrm_url, durations):
+    minutes = to_minutes(durations)
+    with _slot_cache_lock:
+        _slot_cache[cache_key(locations, osrm_url)] = minutes
+        while len(_slot_cache) > SLOT_CACHE_SIZE:
+            _slot_cache.popitem(last=False)
+    return minutes
+
+
+def build_slot_matrices(slots, profiles):
+    # sources[i] is ('matrix', index into the stacked profiles) or ('scale', duration_factor)
+    sources = []
+    stacked = []
+    stacked_index = {}
+    for slot in slots:
+        osrm_url = slot.get('osrm_url')
+        if osrm_url in profiles:
+            if osrm_url not in stacked_index:
+                stacked_index[osrm_url] = len(stacked)
+                stacked.append(profiles[osrm_url])
+            sources.append(('matrix', stacked_index[osrm_url]))
+        else:
+            if osrm_url:
+                logger.warning(f"travel time profile for {slot['start']} unavailable, scaling base durations")
+            sources.append(('scale', float(slot.get('duration_factor', 1.0))))
+    return sources, np.stack(stacked) if stacked else None
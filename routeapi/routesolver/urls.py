@@ -1,6 +1,10 @@
 from django.urls import path
-from .views import get_vpr_solutions
+from .views import get_vpr_solutions, list_solutions, get_solution, get_solution_routes, get_route_stops
 
 urlpatterns = [
-    path('getallroutesolutions/', get_vpr_solutions)
+    path('getallroutesolutions/', get_vpr_solutions),
+    path('solutions/', list_solutions),
+    path('solutions/<str:solution_id>/', get_solution),
+    path('solutions/<str:solution_id>/routes/', get_solution_routes),
+    path('solutions/<str:solution_id>/routes/<str:vehicle_id>/stops/', get_route_stops),
 ]
@@ -3,7 +3,10 @@ from django.http import JsonResponse
 from bson import ObjectId
 from bson.json_util import dumps,loads
 from django.views.decorators.csrf import csrf_exempt
-from .vrp_service import VRPSolver
+from bson.errors import InvalidId
+from .models import routesolver_collection
+from .solutions import render_solution, render_route, render_stop, load_customers, stored_projection, is_compact
+from ..helper.http import parse_fields, parse_page, project, paginate, etag_json_response
 from datetime import datetime
 import json
 import logging
@@ -27,6 +30,7 @@ def get_vpr_solutions(request):
                   service_time=data.get('unLoadingTime')
                   dt = datetime.fromisoformat(invoice_date.replace('Z', '+00:00'))
                   day_of_week = dt.weekday()
+                  from .vrp_service import VRPSolver
                   solver = VRPSolver(invoice_date=invoice_date, mile_range=mile_range,max_orders=max_orders, route_length=route_length, service_time=service_time, day_of_week=day_of_week)
                   order_reports = solver.generate_routing_solutions()               
                   return JsonResponse({"message": order_reports}, safe=False)          
@@ -39,5 +43,88 @@ def get_vpr_solutions(request):
                   return JsonResponse({"error":"unexpected error"}, status=500)
         else:
               return JsonResponse({"error":"invalid request method"}, status=405)
-                                 
-            
\ No newline at end of file
+
+
+SOLUTION_LIST_FIELDS = ['_id', 'solution_id', 'date', 'total_distance', 'matrix_source']
+
+
+def _find_solution(solution_id, projection=None):
+    if solution_id == 'latest':
+        return routesolver_collection.find_one({}, projection, sort=[('_id', -1)])
+    return routesolver_collection.find_one({'solution_id': solution_id}, projection)
+
+
+def _read_only(view):
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return JsonResponse({"error":"invalid request method"}, status=405)
+        try:
+            return view(request, *args, **kwargs)
+        except ValueError as ve:
+            return JsonResponse({'error':str(ve)}, status=400)
+        except Exception:
+            logger.exception("unexpected error occured while reading route solutions")
+            return JsonResponse({"error":"unexpected error"}, status=500)
+    return wrapper
+
+
+@_read_only
+def list_solutions(request):
+    fields = parse_fields(request) or SOLUTION_LIST_FIELDS
+    page, page_size = parse_page(request)
+    cursor = (routesolver_collection.find({}, stored_projection(fields))
+              .sort('_id', -1).skip((page - 1) * page_size).limit(page_size + 1))
+    solutions = [project(render_solution(solution), fields) for solution in cursor]
+    return etag_json_response(request, {
+        'results': solutions[:page_size],
+        'page': page,
+        'page_size': page_size,
+        'has_next': len(solutions) > page_size,
+    })
+
+
+@_read_only
+def get_solution(request, solution_id):
+    fields = parse_fields(request)
+    solution = _find_solution(solution_id, stored_projection(fields))
+    if solution is None:
+        return JsonResponse({"error":"solution not found"}, status=404)
+    return etag_json_response(request, project(render_solution(solution), fields))
+
+
+@_read_only
+def get_solution_routes(request, solution_id):
+    fields = parse_fields(request)
+    page, page_size = parse_page(request)
+    with_stops = bool(fields) and 'stops' in fields
+    solution = _find_solution(solution_id, None if with_stops else {'vehicle_routes.stops': 0})
+    if solution is None:
+        return JsonResponse({"error":"solution not found"}, status=404)
+    routes = paginate(solution.get('vehicle_routes', []), page, page_size)
+    if is_compact(solution):
+        customers = load_customers([stop for route in routes['results'] for stop in route.get('stops', [])])
+        routes['results'] = [render_route(route, solution.get('depot_location'), customers) for route in routes['results']]
+    routes['results'] = [project(route, fields) for route in routes['results']]
+    return etag_json_response(request, routes)
+
+
+@_read_only
+def get_route_stops(request, solution_id, vehicle_id):
+    fields = parse_fields(request)
+    page, page_size = parse_page(request)
+    try:
+        vehicle_object_id = ObjectId(vehicle_id)
+    except InvalidId:
+        raise ValueError("invalid vehicle id")
+    solution = _find_solution(solution_id, {
+        'vehicle_routes': {'$elemMatch': {'vehicle_id': vehicle_object_id}},
+        'depot_location': 1,
+        'format_version': 1,
+    })
+    if solution is None or not solution.get('vehicle_routes'):
+        return JsonResponse({"error":"route not found"}, status=404)
+    stops = paginate(solution['vehicle_routes'][0].get('stops', []), page, page_size)
+    customers = load_customers(stops['results'])
+    stops['results'] = [project(render_stop(stop, solution.get('depot_location'), customers), fields)
+                        for stop in stops['results']]
+    return etag_json_response(request, stops)
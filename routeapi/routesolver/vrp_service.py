@@ -1,14 +1,25 @@
-import googlemaps
-from ortools.constraint_solver import routing_enums_pb2
-from ortools.constraint_solver import pywrapcp
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from datetime import datetime, timedelta
-from .models import routesolver_collection, orders_collection, customer_collection, vehicle_collection, cancelled_invoices
+from django.conf import settings
+from .models import routesolver_collection, orders_collection, customer_collection, vehicle_collection, cancelled_invoices, customer_snaps
 from ..helper.serializer import json_serialize
+from .solutions import SOLUTION_FORMAT_VERSION
+from . import solver_pool
+from .traffic import build_slot_matrices, cache_profile, cached_profile, slot_starts, slot_for
+from ..utils.geo import estimate_road_matrices, great_circle_from
 from decouple import config
 from bson import ObjectId
-import requests
 import json
+import logging
+import numpy as np
+import time
 
+logger = logging.getLogger(__name__)
+_io_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='vrp-io')
+# /nearest calls that outlive the deadline cannot be cancelled, so they must not hold up the table request
+_snap_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='osrm-nearest')
+_snap_cache = {}
+CUSTOMER_FIELDS = {'customer_name': 1, 'address': 1, 'latitude': 1, 'longitude': 1, 'business_start_hour': 1, 'business_close_hour': 1}
 
 class VRPSolver:
     def __init__(self, invoice_date, mile_range,max_orders,route_length,service_time,day_of_week ):
@@ -23,43 +34,293 @@ class VRPSolver:
         self.route_length = int(route_length)
         self.SERVICE_TIME = int(int(service_time)*60)
         self.day_of_week = int(day_of_week)
+        self.cost_model = {
+            'drop_penalty_tiers': sorted(settings.SOLVER_DROP_PENALTY_TIERS, reverse=True),
+            'vehicle_fixed_cost': settings.SOLVER_VEHICLE_FIXED_COST,
+            'lateness_cost_per_second': settings.SOLVER_LATENESS_COST_PER_SECOND,
+            'max_lateness_seconds': settings.SOLVER_MAX_LATENESS_SECONDS,
+        }
+        self.matrix_source = 'osrm'
+        self.out_of_range_orders = []
+        self.suspicious_snaps = []
+        self.osrm_unreachable = False
+        self._osrm_deadline = None
+        self.stage_timings = {}
+        self._load_started = time.perf_counter()
 
-    def seconds_to_time(self,seconds):
-        hours = seconds // 3600
-        minutes = (seconds % 3600)//60
-        return f"{hours: 02d}:{minutes:02d}"
-    
-    def format_travel_time(self,seconds):
-        return f"{seconds//60}min" if seconds < 3600 else f"{seconds//3600}h {(seconds % 3600)//60}m"
-        
-    def get_distance_matrix(self, locations):
-        distance_matrix = []
-        time_matrix = []
-        osrm_url = "http://localhost:6000/table/v1/driving/"
+    def osrm_time_left(self):
+        # snapping, the table and the slot profiles share one OSRM_TIMEOUT_SECONDS budget per plan
+        if self._osrm_deadline is None:
+            self._osrm_deadline = time.monotonic() + settings.OSRM_TIMEOUT_SECONDS
+        return max(self._osrm_deadline - time.monotonic(), 0)
+
+    def request_osrm_matrix(self, locations, base_url=None):
+        import requests
+        osrm_url = f"{base_url or settings.OSRM_URL}/table/v1/driving/"
 
         coordinates =';'.join([f"{lon},{lat}" for lat, lon in locations])
         url = f"{osrm_url}{coordinates}?annotations=distance,duration"
-        result = requests.get(url)
+        result = requests.get(url, timeout=max(self.osrm_time_left(), 0.1))
         if result.status_code != 200:
             raise ValueError(f"failed to get distance, location not found: {result.status_code}")
         data = result.json()
         if "distances" not in data or "durations" not in data:
             raise ValueError("Missing distance/duration from osrm response")
-        distance_matrix = [
-            [int(cell) if cell is not None else 0 for cell in row]
-            for row in data["distances"]
-        ]
-        time_matrix = [
-            [int(cell) if cell is not None else 0 for cell in row]
-            for row in data["durations"]
-        ]
+        # unroutable pairs come back as null, which parses to NaN and is filled by the caller
+        distance_matrix = np.array(data["distances"], dtype=np.float64)
+        time_matrix = np.array(data["durations"], dtype=np.float64)
         return distance_matrix, time_matrix
 
+    def request_osrm_nearest(self, location):
+        import requests
+        latitude, longitude = location
+        url = f"{settings.OSRM_URL}/nearest/v1/driving/{longitude},{latitude}?number=1"
+        result = requests.get(url, timeout=max(self.osrm_time_left(), 0.1))
+        if result.status_code != 200:
+            raise ValueError(f"failed to snap location to road: {result.status_code}")
+        waypoints = result.json().get('waypoints')
+        if not waypoints:
+            raise ValueError("Missing waypoint from osrm nearest response")
+        snapped_longitude, snapped_latitude = waypoints[0]['location']
+        return {
+            'latitude': latitude,
+            'longitude': longitude,
+            'snapped_latitude': snapped_latitude,
+            'snapped_longitude': snapped_longitude,
+            'snap_distance_m': int(round(waypoints[0].get('distance', 0))),
+        }
+
+    def fetch_snap_records(self, customer_ids):
+        if not customer_ids:
+            return {}
+        return {record.pop('_id'): record for record in customer_snaps.find({'_id': {'$in': list(customer_ids)}})}
+
+    def load_snaps(self, customer_locations, stored=None):
+        # a snap is reused until the customer's pin moves
+        def is_current(record, location):
+            return record is not None and (record['latitude'], record['longitude']) == location
+
+        snaps = {}
+        uncached = []
+        for customer_id, location in customer_locations.items():
+            record = _snap_cache.get(customer_id)
+            if is_current(record, location):
+                snaps[customer_id] = record
+            else:
+                uncached.append(customer_id)
+        if uncached:
+            if stored is None:
+                stored = self.fetch_snap_records(uncached)
+            for customer_id in uncached:
+                record = stored.get(customer_id)
+                if is_current(record, customer_locations[customer_id]):
+                    snaps[customer_id] = _snap_cache[customer_id] = record
+        return snaps
+
+    def start_snapping(self, customer_locations, stored=None):
+        snaps = self.load_snaps(customer_locations, stored)
+        pending = {
+            customer_id: _snap_executor.submit(self.request_osrm_nearest, location)
+            for customer_id, location in customer_locations.items() if customer_id not in snaps
+        }
+        return snaps, pending
+
+    def snap_locations(self, customer_id_to_index, locations):
+        customer_locations = {customer_id: locations[node] for customer_id, node in customer_id_to_index.items()}
+        return self.finish_snapping(customer_id_to_index, locations, *self.start_snapping(customer_locations))
+
+    def finish_snapping(self, customer_id_to_index, locations, snaps, pending):
+        from pymongo import ReplaceOne
+        # customers screened out after snapping started are not waited for
+        for customer_id in [customer_id for customer_id in pending if customer_id not in customer_id_to_index]:
+            pending.pop(customer_id).cancel()
+        failed = 0
+        for customer_id, future in pending.items():
+            try:
+                snaps[customer_id] = _snap_cache[customer_id] = future.result(timeout=self.osrm_time_left())
+            except Exception as e:
+                future.cancel()
+                failed += 1
+                logger.debug(f"could not snap customer {customer_id}: {e!r}")
+        if failed:
+            logger.warning(f"could not snap {failed} customer locations to the road network, using raw coordinates")
+        if pending and failed == len(pending):
+            self.osrm_unreachable = True
+        stored = [ReplaceOne({'_id': customer_id}, snaps[customer_id], upsert=True) for customer_id in pending if customer_id in snaps]
+        if stored:
+            customer_snaps.bulk_write(stored, ordered=False)
+
+        snapped_locations = list(locations)
+        self.suspicious_snaps = []
+        for customer_id, node in customer_id_to_index.items():
+            record = snaps.get(customer_id)
+            if record is None:
+                continue
+            snapped_locations[node] = (record['snapped_latitude'], record['snapped_longitude'])
+            if record['snap_distance_m'] > settings.OSRM_MAX_SNAP_DISTANCE_M:
+                self.suspicious_snaps.append({'customer_id': customer_id, 'snap_distance_m': record['snap_distance_m']})
+        if self.suspicious_snaps:
+            logger.warning(f"{len(self.suspicious_snaps)} customers are more than {settings.OSRM_MAX_SNAP_DISTANCE_M}m from a road: {self.suspicious_snaps}")
+        return snapped_locations
+
+    def estimate_matrix(self, locations):
+        return estimate_road_matrices(
+            locations,
+            settings.HAVERSINE_CIRCUITY_FACTOR,
+            settings.HAVERSINE_AVERAGE_SPEED_KMH,
+        )
+
+    def get_distance_matrix(self, locations):
+        import requests
+        if self.osrm_unreachable or not self.osrm_time_left():
+            logger.warning("osrm did not answer within the time budget, using great-circle estimate")
+            self.matrix_source = 'haversine'
+            return self.estimate_matrix(locations)
+        osrm_future = _io_executor.submit(self._timed, 'osrm_table', self.request_osrm_matrix, locations)
+        try:
+            matrices = osrm_future.result(timeout=self.osrm_time_left())
+            self.matrix_source = 'osrm'
+        except (FutureTimeoutError, requests.RequestException, ValueError) as e:
+            logger.warning(f"osrm unavailable, using great-circle estimate: {e!r}")
+            osrm_future.cancel()
+            self.matrix_source = 'haversine'
+            return self.estimate_matrix(locations)
+        # the estimate is only built when osrm left cells unroutable
+        missing = [np.isnan(matrix) for matrix in matrices]
+        unroutable = sum(int(mask.sum()) for mask in missing)
+        if not unroutable:
+            return tuple(matrix.astype(np.int64) for matrix in matrices)
+        logger.warning(f"osrm found no route for {unroutable} matrix cells, using great-circle estimate for them")
+        return tuple(
+            np.where(mask, estimate, matrix).astype(np.int64)
+            for matrix, mask, estimate in zip(matrices, missing, self.estimate_matrix(locations))
+        )
+
+    def fetch_slot_profiles(self, locations, time_matrix, osrm_urls):
+        import requests
+        profiles = {}
+        pending = {}
+        for osrm_url in osrm_urls:
+            profile = cached_profile(locations, osrm_url)
+            if profile is not None:
+                profiles[osrm_url] = profile
+            elif self.matrix_source == 'osrm' and self.osrm_time_left():
+                pending[osrm_url] = _io_executor.submit(self.request_osrm_matrix, locations, osrm_url)
+        for osrm_url, future in pending.items():
+            try:
+                _, durations = future.result(timeout=self.osrm_time_left())
+            except (FutureTimeoutError, requests.RequestException, ValueError) as e:
+                logger.warning(f"travel time profile {osrm_url} unavailable: {e!r}")
+                future.cancel()
+                continue
+            profiles[osrm_url] = cache_profile(locations, osrm_url, np.where(np.isnan(durations), time_matrix, durations))
+        return profiles
+
+    def get_time_slots(self, locations, time_matrix):
+        slots = sorted(settings.TRAVEL_TIME_SLOTS, key=lambda slot: slot_starts([slot])[0])
+        if not slots:
+            return None, None, None
+        # profiles are fetched in parallel under the plan's OSRM deadline, and not at all once
+        # the base matrix has fallen back to the estimate
+        osrm_urls = {slot['osrm_url'] for slot in slots if slot.get('osrm_url')}
+        profiles = self.fetch_slot_profiles(locations, time_matrix, osrm_urls)
+        slot_sources, slot_matrices = build_slot_matrices(slots, profiles)
+        return slot_starts(slots), slot_sources, slot_matrices
+
+    def screen_out_of_range(self, orders, customers, depot_location):
+        # a stop whose straight-line round trip already exceeds the range can never be served
+        positions = []
+        coordinates = []
+        for position, order in enumerate(orders):
+            customer_data = customers.get(str(order['customer']), {})
+            try:
+                coordinates.append((float(customer_data['latitude']), float(customer_data['longitude'])))
+            except (KeyError, TypeError, ValueError):
+                continue
+            positions.append(position)
+        if not coordinates:
+            return orders, []
+        round_trip = 2 * great_circle_from(depot_location, coordinates)
+        limit = self.mile_range * 1600
+        too_far = {positions[k] for k, meters in enumerate(round_trip) if meters > limit}
+        if not too_far:
+            return orders, []
+        in_range = [order for position, order in enumerate(orders) if position not in too_far]
+        out_of_range = [order for position, order in enumerate(orders) if position in too_far]
+        logger.info(f"screened out {len(out_of_range)} orders beyond {self.mile_range} miles")
+        return in_range, out_of_range
+
+    def _timed(self, stage, func, *args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.stage_timings[stage] = (started - self._load_started, time.perf_counter() - self._load_started)
+
+    def _log_stage_timings(self):
+        if not self.stage_timings:
+            return
+        for stage, (started, finished) in sorted(self.stage_timings.items(), key=lambda item: item[1][0]):
+            overlapping = [
+                other for other, (other_started, other_finished) in self.stage_timings.items()
+                if other != stage and other_started < finished and started < other_finished
+            ]
+            logger.info(f"stage {stage}: +{started*1000:.0f}ms -> +{finished*1000:.0f}ms, overlaps {overlapping or 'none'}")
+        busy = sum(finished - started for started, finished in self.stage_timings.values())
+        wall = max(finished for _, finished in self.stage_timings.values()) - min(started for started, _ in self.stage_timings.values())
+        logger.info(f"data loading took {wall*1000:.0f}ms wall clock for {busy*1000:.0f}ms of stage time")
+
+    def fetch_invoices(self):
+        return list(orders_collection.find({'invoice_date':{'$gte':self.start_day,'$lt':self.end_day}, 'in_person':False},{'_id': 1, 'ot_date': 1, 'delivery_status': 1, 'items.weight_kg': 1,'items.quantity': 1,'customer':1, 'priority_value': 1}))
+
+    def fetch_cancelled_set(self):
+        cancelled_customers = cancelled_invoices.find({'ot_date':{'$gte':self.start_cancelled_ot_day, '$lt':self.end_day}},{'customer': 1, '_id': 0, 'ot_date': 1})
+        return {(doc['customer'], doc['ot_date']) for doc in cancelled_customers}
+
+    def fetch_customers(self, customer_ids):
+        return {str(cust['_id']): cust
+                for cust in customer_collection.find({'_id':{'$in':list(customer_ids)}}, CUSTOMER_FIELDS)}
+
+    def fetch_vehicles(self):
+        return list(vehicle_collection.find({'availability':'available'}))
+
+    def customer_locations(self, customers, customer_ids):
+        locations = {}
+        for customer_id in customer_ids:
+            customer_data = customers.get(str(customer_id), {})
+            try:
+                locations[customer_data['_id']] = (float(customer_data['latitude']), float(customer_data['longitude']))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return locations
+
     def get_orders_for_routing(self):
-        orders_raw = list(orders_collection.find({'invoice_date':{'$gte':self.start_day,'$lt':self.end_day}, 'in_person':False},{'_id': 1, 'ot_date': 1, 'delivery_status': 1, 'items.weight_kg': 1,'items.quantity': 1,'customer':1, 'priority_value': 1}))
-        cancelled_customers = list(cancelled_invoices.find({'ot_date':{'$gte':self.start_cancelled_ot_day, '$lt':self.end_day}},{'customer': 1, '_id': 0, 'ot_date': 1}))
-        cancelled_set = {(doc['customer'], doc['ot_date']) for doc in cancelled_customers}
+        self._load_started = time.perf_counter()
+        self.stage_timings = {}
+        vehicles_future = _io_executor.submit(self._timed, 'vehicles', self.fetch_vehicles)
+        cancelled_future = _io_executor.submit(self._timed, 'cancelled_invoices', self.fetch_cancelled_set)
+        orders_raw = self._timed('invoices', self.fetch_invoices)
+        # customers of cancelled invoices are fetched too so the lookup need not wait for the cancellation set
+        customer_ids = {order['customer'] for order in orders_raw if 'customer' in order}
+        customers_future = _io_executor.submit(self._timed, 'customers', self.fetch_customers, customer_ids)
+        # stored road snaps are keyed by customer id, so they are read alongside the customers
+        snap_records_future = _io_executor.submit(
+            self._timed, 'snap_records', self.fetch_snap_records, [customer_id for customer_id in customer_ids if customer_id not in _snap_cache]
+        )
+        cancelled_set = cancelled_future.result()
         filtered_orders = [order for order in orders_raw if (order['customer'], order['ot_date']) not in cancelled_set]
+        customers = customers_future.result()
+
+        # snapping only needs the pins, so /nearest calls for new or moved customers run while the
+        # orders are grouped, screened and turned into windows. The table request still needs the
+        # final location set and starts after that
+        self._osrm_deadline = time.monotonic() + settings.OSRM_TIMEOUT_SECONDS
+        self.osrm_unreachable = False
+        snapping_started = time.perf_counter()
+        snaps, pending_snaps = self.start_snapping(
+            self.customer_locations(customers, {order['customer'] for order in filtered_orders}),
+            snap_records_future.result(),
+        )
 
         customer_orders = {}
         for order in filtered_orders:
@@ -77,10 +338,7 @@ class VRPSolver:
         orders = list(customer_orders.values())
         if not orders:
             raise ValueError("no order found for the invoice date")
-        customer_ids = [order['customer'] for order in orders if 'customer' in order]
-        customers = {str(cust['_id']): cust
-                     for cust in customer_collection.find({'_id':{'$in':customer_ids}})}                         
-        vehicles = list(vehicle_collection.find({'availability':'available'}))        
+        vehicles = vehicles_future.result()
         if not vehicles:
             raise ValueError("vehicles are not available for orders")
         for veh in vehicles:
@@ -97,6 +355,12 @@ class VRPSolver:
        
         depot_location_str = vehicle_details[0]['current_location']
         depot_location = tuple(map(float, depot_location_str.split(',')))
+        orders, out_of_range = self.screen_out_of_range(orders, customers, depot_location)
+        self.out_of_range_orders = [
+            order_id for order in out_of_range for order_id in order.get('original_orders', [order['_id']])
+        ]
+        if not orders:
+            raise ValueError(f"no order found within {self.mile_range} miles of the depot")
         locations = [depot_location]
         demand = [0]
         customer_id_to_index = {}
@@ -154,11 +418,18 @@ class VRPSolver:
             time_windows.append((second_start,second_end))
             priority_weight.append(order.get('priority_value'))
         
-        distance_matrix, time_matrix = self.get_distance_matrix(locations)
+        road_locations = self.finish_snapping(customer_id_to_index, locations, snaps, pending_snaps)
+        self.stage_timings['road_snapping'] = (snapping_started - self._load_started, time.perf_counter() - self._load_started)
+        distance_matrix, time_matrix = self.get_distance_matrix(road_locations)
+        time_slot_starts, slot_sources, slot_matrices = self._timed('time_slots', self.get_time_slots, road_locations, time_matrix)
+        self._log_stage_timings()
         return {
             'depot_index': 0,
             'distance_matrix': distance_matrix,
             'time_matrix': time_matrix,
+            'slot_start_times': time_slot_starts,
+            'slot_sources': slot_sources,
+            'slot_matrices': slot_matrices,
             'vehicle_capacities': vehicle_capacities,
             'demand': demand,
             'locations': locations,
@@ -172,124 +443,223 @@ class VRPSolver:
             'original_orders_mapping': original_orders_mapping,
         }
     
-    def solve_vrp(self, depot_index, distance_matrix, vehicle_capacities, demands, num_vehicles, time_windows, time_matrix, priority_weight):
+    def drop_penalty(self, raw_priority, max_arc_cost):
+        # scaled to the largest arc so a drop always costs more than any detour to serve it
+        try: 
+            priority = int(raw_priority)
+        except (TypeError, ValueError):
+            priority = 10
+        tiers = self.cost_model['drop_penalty_tiers']
+        multiplier = next((multiplier for threshold, multiplier in tiers if priority >= threshold), tiers[-1][1])
+        return int(multiplier * max_arc_cost)
+
+    def solve_vrp(self, depot_index, distance_matrix, vehicle_capacities, demands, num_vehicles, time_windows, time_matrix, priority_weight, slot_start_times=None, slot_sources=None, slot_matrices=None):
+        from ortools.constraint_solver import routing_enums_pb2
+        from ortools.constraint_solver import pywrapcp
         num_nodes = len(distance_matrix)
         assert num_nodes > 0, "Distance matrix is empty"
         for row in distance_matrix:
             assert len(row) == num_nodes, "Distance matrix is not square"
-        manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot_index)
-        routing = pywrapcp.RoutingModel(manager)
-       
-        def distance_callback(from_index, to_index):
-            try:
+        SERVICE_TIME = self.SERVICE_TIME
+        vehicle_fixed_cost = int(self.cost_model['vehicle_fixed_cost'])
+        lateness_cost = int(self.cost_model['lateness_cost_per_second'])
+        max_lateness = int(self.cost_model['max_lateness_seconds']) if lateness_cost else 0
+        max_arc_cost = max(1, max(max(row) for row in distance_matrix))
+        penalties = {}
+        for node in range(1, len(distance_matrix)):           
+            raw_priority = priority_weight[node-1] if(node-1) < len(priority_weight) else 0
+            penalties[node] = self.drop_penalty(raw_priority, max_arc_cost)
+
+        def build_model(travel_time):
+            manager = pywrapcp.RoutingIndexManager(len(distance_matrix), num_vehicles, depot_index)
+            routing = pywrapcp.RoutingModel(manager)
+
+            def distance_callback(from_index, to_index):
+                try:
+                    from_node = manager.IndexToNode(from_index)
+                    to_node = manager.IndexToNode(to_index)
+                    return distance_matrix[from_node][to_node]
+                except OverflowError as oe:
+                    print(f"overflow eror in index conversion: {oe}")
+                    raise ValueError("invalid index type")
+                except IndexError as ie:
+                    print(f"index error: {ie}")
+                    raise ValueError('reset cusotmer address on map')
+
+            transit_callback_index = routing.RegisterTransitCallback(distance_callback)
+            routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+            if vehicle_fixed_cost:
+                routing.SetFixedCostOfAllVehicles(vehicle_fixed_cost)
+
+            def demand_callback(from_index):
+                from_node = manager.IndexToNode(from_index)
+                return demands[from_node]
+
+            demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
+            routing.AddDimensionWithVehicleCapacity(
+                demand_callback_index,
+                0,
+                vehicle_capacities,
+                True,
+                'Capacity'
+            )
+
+            def count_callback(from_index):
+                from_node = manager.IndexToNode(from_index)
+                return 0 if from_node == depot_index else 1
+
+            count_callback_index = routing.RegisterUnaryTransitCallback(count_callback)
+            routing.AddDimensionWithVehicleCapacity(
+                count_callback_index,
+                0,
+                [self.max_orders] * num_vehicles,
+                True,
+                'OrderCount',
+            )
+            routing.AddDimension(
+                transit_callback_index,
+                0,
+                self.mile_range*1600,
+                True,
+                'Distance',
+            )
+
+            def time_callback(from_index, to_index):
                 from_node = manager.IndexToNode(from_index)
                 to_node = manager.IndexToNode(to_index)
-                return distance_matrix[from_node][to_node]
-            except OverflowError as oe:
-                print(f"overflow eror in index conversion: {oe}")
-                raise ValueError("invalid index type")
-            except IndexError as ie:
-                print(f"index error: {ie}")
-                raise ValueError('reset cusotmer address on map')
-    
-        transit_callback_index = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(transit_callback_index)
+                service_time = SERVICE_TIME if from_node != depot_index else 0
+                return travel_time(from_node, to_node) + service_time
 
-        def demand_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return demands[from_node]
-        
-        demand_callback_index = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_callback_index,
-            0,
-            vehicle_capacities,
-            True,
-            'Capacity'
-        )
+            time_callback_index = routing.RegisterTransitCallback(time_callback)
+            routing.AddDimension(
+                time_callback_index,
+                20*60, 
+                24*3600, 
+                False,
+                'Time',
+            )
+            time_dimension = routing.GetDimensionOrDie('Time')
+            for i,time_window in enumerate(time_windows):
+                if i == depot_index:
+                    continue
+                index = manager.NodeToIndex(i)
+                time_dimension.CumulVar(index).SetRange(time_window[0], min(time_window[1] + max_lateness, 24*3600))
+                if lateness_cost:
+                    time_dimension.SetCumulVarSoftUpperBound(index, time_window[1], lateness_cost)
 
-        def count_callback(from_index):
-            from_node = manager.IndexToNode(from_index)
-            return 0 if from_node == depot_index else 1
-        
-        count_callback_index = routing.RegisterUnaryTransitCallback(count_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            count_callback_index,
-            0,
-            [self.max_orders] * num_vehicles,
-            True,
-            'OrderCount',
-        )
-        routing.AddDimension(
-            transit_callback_index,
-            0,
-            self.mile_range*1600,
-            True,
-            'Distance',
-        )
-        SERVICE_TIME = self.SERVICE_TIME
-        def time_callback(from_index, to_index):
-            from_node = manager.IndexToNode(from_index)
-            to_node = manager.IndexToNode(to_index)
-            service_time = SERVICE_TIME if from_node != depot_index else 0
-            return time_matrix[from_node][to_node] + service_time
-        
-        time_callback_index = routing.RegisterTransitCallback(time_callback)
-        routing.AddDimension(
-            time_callback_index,
-            20*60, 
-            24*3600, 
-            False,
-            'Time',
-        )
-        time_dimension = routing.GetDimensionOrDie('Time')
-        for i,time_window in enumerate(time_windows):
-            if i == depot_index:
-                continue
-            index = manager.NodeToIndex(i)
-            time_dimension.CumulVar(index).SetRange(time_window[0], time_window[1])
-
-        max_route_duration = self.route_length * 3600 
-        for vehicle_id in range(num_vehicles):
-            start_idx = routing.Start(vehicle_id)
-            end_idx = routing.End(vehicle_id)
-            solver = routing.solver()
-            route_duration = time_dimension.CumulVar(end_idx)-time_dimension.CumulVar(start_idx)
-            solver.Add(route_duration <= max_route_duration)
-            
-        
-        for node in range(1, len(distance_matrix)):           
-            raw_priority = priority_weight[node-1] if(node-1) < len(priority_weight) else 0
-            try: 
-                priority = int(raw_priority)
-            except (TypeError, ValueError):
-                priority = 10
-            if priority >= 1000:
-                penalty = 10000000000000000
-            elif priority >= 100:
-                penalty = 1000000000000000
-            else:
-                penalty = 100000000000000          
-            routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
-        
-        search_parameters = pywrapcp.DefaultRoutingSearchParameters() 
-        search_parameters.first_solution_strategy = (
-            routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        )
-        search_parameters.local_search_metaheuristic = (
-            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        )
-        search_parameters.time_limit.seconds = 50
-        search_parameters.lns_time_limit.seconds = 30    
-        solution = routing.SolveWithParameters(search_parameters)
+            max_route_duration = self.route_length * 3600 
+            for vehicle_id in range(num_vehicles):
+                start_idx = routing.Start(vehicle_id)
+                end_idx = routing.End(vehicle_id)
+                solver = routing.solver()
+                route_duration = time_dimension.CumulVar(end_idx)-time_dimension.CumulVar(start_idx)
+                solver.Add(route_duration <= max_route_duration)
+
+            for node, penalty in penalties.items():
+                routing.AddDisjunction([manager.NodeToIndex(node)], penalty)
+            return manager, routing
+
+        def search_parameters(time_limit):
+            search_parameters = pywrapcp.DefaultRoutingSearchParameters() 
+            search_parameters.first_solution_strategy = (
+                routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
+            )
+            search_parameters.local_search_metaheuristic = (
+                routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
+            )
+            search_parameters.time_limit.seconds = time_limit
+            search_parameters.lns_time_limit.seconds = 30    
+            return search_parameters
+
+        def slot_travel_time(departure_slot, first_leg_slot):
+            # profile slots are whole minutes from to_minutes; factor slots scale the base seconds
+            leaving = [slot_sources[slot] for slot in departure_slot]
+            first_leg = [slot_sources[slot] for slot in first_leg_slot]
+
+            def travel_time(from_node, to_node):
+                kind, value = first_leg[to_node] if from_node == depot_index else leaving[from_node]
+                if kind == 'matrix':
+                    return slot_matrices[value][from_node][to_node] * 60
+                return int(time_matrix[from_node][to_node] * value)
+            return travel_time
+
+        time_limit = 50
+        if slot_sources:
+            # transit callbacks never see the cumul, so the first pass takes each node's departure
+            # slot from the start of its time window. The second pass reads the slots off the solved
+            # schedule (depot departures use the vehicle start) and re-solves from that solution
+            departure_slot = [slot_for(start, slot_start_times) for start, _ in time_windows]
+            travel_time = slot_travel_time(departure_slot, departure_slot)
+            manager, routing = build_model(travel_time)
+            solution = routing.SolveWithParameters(search_parameters(time_limit // 3))
+            if solution:
+                time_dimension = routing.GetDimensionOrDie('Time')
+                solved_departure_slot = list(departure_slot)
+                solved_first_leg_slot = list(departure_slot)
+                routes = []
+                for vehicle_id in range(num_vehicles):
+                    index = routing.Start(vehicle_id)
+                    first_leg_slot = slot_for(solution.Min(time_dimension.CumulVar(index)), slot_start_times)
+                    route = []
+                    index = solution.Value(routing.NextVar(index))
+                    while not routing.IsEnd(index):
+                        node = manager.IndexToNode(index)
+                        if not route:
+                            solved_first_leg_slot[node] = first_leg_slot
+                        solved_departure_slot[node] = slot_for(solution.Min(time_dimension.CumulVar(index)) + SERVICE_TIME, slot_start_times)
+                        route.append(node)
+                        index = solution.Value(routing.NextVar(index))
+                    routes.append(route)
+
+                second_travel_time = slot_travel_time(solved_departure_slot, solved_first_leg_slot)
+                second_manager, second_routing = build_model(second_travel_time)
+                parameters = search_parameters(time_limit - time_limit // 3)
+                second_routing.CloseModelWithParameters(parameters)
+                initial_solution = second_routing.ReadAssignmentFromRoutes(routes, True)
+                if initial_solution:
+                    second_solution = second_routing.SolveFromAssignmentWithParameters(initial_solution, parameters)
+                else:
+                    second_solution = second_routing.SolveWithParameters(parameters)
+                if second_solution:
+                    manager, routing, solution, travel_time = second_manager, second_routing, second_solution, second_travel_time
+                else:
+                    logger.warning("re-solve with departure-time slots found no solution, keeping the first pass")
+        else:
+            def travel_time(from_node, to_node):
+                return time_matrix[from_node][to_node]
+
+            manager, routing = build_model(travel_time)
+            solution = routing.SolveWithParameters(search_parameters(time_limit))
        
         solution_data = {
             'routes': [],
-            'total_distance':0
+            'total_distance':0,
+            'dropped_nodes': [],
+            'objective': {},
         }
         if solution:
-            solution_data['total_distance'] = solution.ObjectiveValue()
             time_dimension = routing.GetDimensionOrDie('Time')
+            dropped_nodes = {
+                node for node in penalties
+                if solution.Value(routing.NextVar(manager.NodeToIndex(node))) == manager.NodeToIndex(node)
+            }
+            lateness = 0
+            if lateness_cost:
+                for i,time_window in enumerate(time_windows):
+                    if i == depot_index or i in dropped_nodes:
+                        continue
+                    arrival = solution.Min(time_dimension.CumulVar(manager.NodeToIndex(i)))
+                    lateness += max(0, arrival - time_window[1])
+            used_vehicles = sum(1 for vehicle_id in range(num_vehicles) if routing.IsVehicleUsed(solution, vehicle_id))
+            solution_data['dropped_nodes'] = [{'node': node, 'penalty': penalties[node]} for node in sorted(dropped_nodes)]
+            solution_data['objective'] = {
+                'total': solution.ObjectiveValue(),
+                'distance': 0,
+                'drops': sum(penalties[node] for node in dropped_nodes),
+                'lateness': lateness * lateness_cost,
+                'lateness_seconds': lateness,
+                'vehicle_fixed': used_vehicles * vehicle_fixed_cost,
+            }
         
             for vehicle_id in range(num_vehicles):
                 index = routing.Start(vehicle_id)
@@ -313,10 +683,10 @@ class VRPSolver:
                     previous_index = index
                     next_index = solution.Value(routing.NextVar(index))
                     next_node =manager.IndexToNode(next_index)
-                    route_distance += routing.GetArcCostForVehicle(index, next_index, vehicle_id)
                     arrival_time = solution.Min(time_dimension.CumulVar(next_index))
-                    travel_time = time_matrix[node][next_node]
+                    leg_time = travel_time(node, next_node)
                     distance = distance_matrix[node][next_node]
+                    route_distance += distance
 
                     if next_node != depot_index:
                         actual_arrival = arrival_time - SERVICE_TIME
@@ -328,7 +698,7 @@ class VRPSolver:
                         'type': 'depot' if next_node == depot_index else 'customer',
                         'arrival_time': actual_arrival,
                         'departure_time': arrival_time,
-                        'travel_time': travel_time,
+                        'travel_time': leg_time,
                         'distance': distance,
                     })
                     index = next_index
@@ -340,27 +710,44 @@ class VRPSolver:
                     'route_detail': route_details,
                     'distance': route_distance
                 })
+                solution_data['total_distance'] += route_distance
+            solution_data['objective']['distance'] = solution_data['total_distance']
         return solution_data
     
     def generate_routing_solutions(self):
         vrp_data = self.get_orders_for_routing()
-        solution = self.solve_vrp(
-            vrp_data['depot_index'],
-            vrp_data['distance_matrix'],
-            vrp_data['vehicle_capacities'],
-            vrp_data['demand'],
-            vrp_data['num_vehicles'],
-            vrp_data['time_windows'],
-            vrp_data['time_matrix'],
-            vrp_data['priority_weight']
-        )   
+        solution = solver_pool.solve(
+            self,
+            depot_index=vrp_data['depot_index'],
+            distance_matrix=vrp_data['distance_matrix'],
+            vehicle_capacities=vrp_data['vehicle_capacities'],
+            demands=vrp_data['demand'],
+            num_vehicles=vrp_data['num_vehicles'],
+            time_windows=vrp_data['time_windows'],
+            time_matrix=vrp_data['time_matrix'],
+            priority_weight=vrp_data['priority_weight'],
+            slot_start_times=vrp_data['slot_start_times'],
+            slot_sources=vrp_data['slot_sources'],
+            slot_matrices=vrp_data['slot_matrices'],
+        )
         mapped_solution = {
             "solution_id" : f"SOL_{datetime.now().strftime('%Y%m%d%H%M%S')}",
             'date' : self.start_day,
-            'total_distance' : round(solution['total_distance']/1600,2),
+            'format_version': SOLUTION_FORMAT_VERSION,
+            'total_distance_m' : solution['total_distance'],
+            'depot_location': list(vrp_data['locations'][vrp_data['depot_index']]),
+            'matrix_source': self.matrix_source,
+            'out_of_range_orders': self.out_of_range_orders,
+            'suspicious_snaps': self.suspicious_snaps,
+            'objective': solution['objective'],
+            'dropped_orders': [{
+                'customer_id': vrp_data['orders'][dropped['node'] - 1]['customer'],
+                'original_order_ids': vrp_data['original_orders_mapping'].get(dropped['node'], []),
+                'priority_value': vrp_data['priority_weight'][dropped['node'] - 1],
+                'penalty': dropped['penalty'],
+            } for dropped in solution['dropped_nodes']],
             'vehicle_routes': []
         } 
-        total_weights = {}
         for route in solution['routes']:
             if len(route['route_detail']) <= 2:
                 continue
@@ -372,65 +759,35 @@ class VRPSolver:
                     node = stop['node']   
                     if node != vrp_data['depot_index']:
                         total_weight += vrp_data['demand'][node] 
-            total_weights[vehicle_id] = total_weight
             route_details = {
                 'vehicle_id':ObjectId(vehicle['_id']),
                 'stops':[],
-                'distance_veh_km': round(route['distance']/1600, 2),
-                'total_weight_kg_veh': total_weight
+                'distance_m': route['distance'],
+                'total_weight_kg': total_weight
             }       
             for i,stop in enumerate(route['route_detail']):
                 stop_index = stop['node']
-              
+                compact_stop = {
+                    'arrival_s': stop['arrival_time'],
+                    'departure_s': stop['departure_time'],
+                    'travel_s': stop['travel_time'],
+                    'distance_m': stop['distance'],
+                }
                 if stop_index == vrp_data['depot_index']:
-                    is_final_depot = (i == len(route['route_detail'])-1)
-                    location_ary = vrp_data['locations'][stop_index]
-                    location_string = f"{location_ary[0]},{location_ary[1]}"
-                    if is_final_depot:
-                        adjusted_arrival = stop['arrival_time'] - self.SERVICE_TIME
-                        route_details['stops'].append({
-                        'type':'depot',
-                        'location':location_string,
-                        'address': "Depot Location",
-                        'departure_time': self.seconds_to_time(stop['departure_time']),
-                        'arrival_time': self.seconds_to_time(adjusted_arrival),
-                        'travel_time': self.format_travel_time(stop['travel_time']),
-                        'distance': round(stop['distance']/1600,2),
-                    })
-                    else:                        
-                        route_details['stops'].append({
-                        'type':'depot',
-                        'location':location_string,
-                        'address': "Depot Location",
-                        'departure_time': self.seconds_to_time(stop['departure_time']),
-                        'arrival_time': self.seconds_to_time(stop['arrival_time']),
-                        'travel_time': self.format_travel_time(stop['travel_time']),
-                        'distance': round(stop['distance']/1600,2),
-                    })
+                    if i == len(route['route_detail'])-1:
+                        compact_stop['arrival_s'] = stop['arrival_time'] - self.SERVICE_TIME
+                    route_details['stops'].append({'type': 'depot', **compact_stop})
                 else:
-                    order_index = stop_index - 1  
-                    order = vrp_data['orders'][order_index]
-                    customer_id =str(order['customer'])
-                    customer_array = vrp_data['customers']
-                    customer = customer_array[customer_id]
+                    order = vrp_data['orders'][stop_index - 1]
+                    customer = vrp_data['customers'][str(order['customer'])]
                     if(customer):
-                        latitude= customer.get('latitude')
-                        longitude = customer.get('longitude')
-                        location_str = f"{latitude},{longitude}"
-                        stop_weight = vrp_data['demand'][stop_index]
                         route_details['stops'].append({
                             'type': 'delivery',
                             'order_id': order['_id'],
                             'original_order_ids': vrp_data['original_orders_mapping'].get(stop_index, []),
                             'customer_id': customer['_id'],
-                            'customer_name': customer['customer_name'],
-                            'address': customer['address'],
-                            'location': location_str, 
-                            'arrival_time': self.seconds_to_time(stop['arrival_time']),
-                            'travel_time': self.format_travel_time(stop['travel_time']),
-                            'distance': round(stop['distance']/1600,2),
-                            'departure_time': self.seconds_to_time(stop['departure_time']),
-                            'order_weight': stop_weight,                                                                        
+                            'order_weight': vrp_data['demand'][stop_index],
+                            **compact_stop,
                         })
             route_details['zone'] = f"Zone - {len(mapped_solution['vehicle_routes'])+1}"
             mapped_solution['vehicle_routes'].append(route_details)      
@@ -439,9 +796,10 @@ class VRPSolver:
             vehicle_collection.update_one({
                 '_id': ObjectId(veh['vehicle_id'])
             }, {'$set': {'status': 'assigned'}})  
+        # the office placeholder is stored already formatted and passed through on read
         mapped_solution['vehicle_routes'].insert(0,{
-           "distance_veh_km": 0,
-           "total_weight_kg_veh": 0,
+           "distance_m": 0,
+           "total_weight_kg": 0,
            "zone": "Zone - Office",
            "vehicle_id": ObjectId("659419c572707b2a064b1788"),
            "stops": [
@@ -1,3 +1,634 @@
-from django.test import TestCase
+from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from unittest import mock
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from pymongo import ReplaceOne
+import numpy as np
+import os
+import time
+from .helper.http import etag_json_response, paginate, parse_page, project
+from .routesolver.solutions import SOLUTION_FORMAT_VERSION, render_solution, stored_projection
+from .routesolver import solver_pool, traffic, vrp_service
+from .routesolver.traffic import build_slot_matrices, slot_for, slot_starts, to_minutes
+from .routesolver.vrp_service import VRPSolver
+from .utils import db
+from .utils.db import LazyCollection, get_mongo_connection
+from .utils.geo import great_circle_matrix, great_circle_from, estimate_road_matrices
 
-# Create your tests here.
+GLASGOW = (55.8642, -4.2518)
+EDINBURGH = (55.9533, -3.1883)
+
+
+def make_solver(mile_range=50):
+    return VRPSolver('2026-10-19T00:00:00Z', mile_range, 15, 8, 10, 0)
+
+
+class StubSolver:
+    # stands in for VRPSolver in the pool tests: picklable, cheap, and reports where it ran
+    def __init__(self, delay=0, crash_in_worker=False):
+        self.delay = delay
+        self.crash_in_worker = crash_in_worker
+        self.parent_pid = os.getpid()
+
+    def solve_vrp(self, distance_matrix, time_matrix, slot_matrices=None, **inputs):
+        if self.crash_in_worker and os.getpid() != self.parent_pid:
+            os._exit(1)
+        time.sleep(self.delay)
+        return {
+            'pid': os.getpid(),
+            'distance_matrix': distance_matrix,
+            'time_matrix': time_matrix,
+            'slot_matrices': slot_matrices,
+            'inputs': inputs,
+        }
+
+
+class GeoTests(SimpleTestCase):
+    def test_great_circle_matrix_is_symmetric(self):
+        matrix = great_circle_matrix([GLASGOW, EDINBURGH, (55.8, -4.3)])
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertTrue((matrix == matrix.T).all())
+        self.assertEqual(matrix.diagonal().tolist(), [0.0, 0.0, 0.0])
+
+    def test_glasgow_to_edinburgh(self):
+        self.assertAlmostEqual(great_circle_matrix([GLASGOW, EDINBURGH])[0][1], 67000, delta=1000)
+
+    def test_great_circle_from_matches_matrix_row(self):
+        locations = [GLASGOW, EDINBURGH, (55.8, -4.3)]
+        self.assertEqual(great_circle_from(GLASGOW, locations).tolist(), great_circle_matrix(locations)[0].tolist())
+
+    def test_estimate_road_matrices(self):
+        distances, durations = estimate_road_matrices([GLASGOW, EDINBURGH], 1.3, 36)
+        straight = great_circle_matrix([GLASGOW, EDINBURGH])[0][1]
+        self.assertEqual(distances.dtype, np.int64)
+        self.assertEqual(distances[0][1], round(straight * 1.3))
+        # 36 km/h is 10 m/s
+        self.assertEqual(durations[0][1], round(straight * 1.3 / 10))
+
+
+class ScreenOutOfRangeTests(SimpleTestCase):
+    def test_drops_orders_beyond_the_round_trip_range(self):
+        orders = [{'customer': 'near'}, {'customer': 'far'}, {'customer': 'unknown'}]
+        customers = {
+            'near': {'latitude': '55.87', 'longitude': '-4.26'},
+            'far': {'latitude': EDINBURGH[0], 'longitude': EDINBURGH[1]},
+        }
+        in_range, out_of_range = make_solver(mile_range=50).screen_out_of_range(orders, customers, GLASGOW)
+        # orders without coordinates are left for the solver to deal with
+        self.assertEqual(in_range, [{'customer': 'near'}, {'customer': 'unknown'}])
+        self.assertEqual(out_of_range, [{'customer': 'far'}])
+
+    def test_keeps_everything_in_range(self):
+        orders = [{'customer': 'far'}]
+        customers = {'far': {'latitude': EDINBURGH[0], 'longitude': EDINBURGH[1]}}
+        self.assertEqual(make_solver(mile_range=100).screen_out_of_range(orders, customers, GLASGOW), (orders, []))
+
+
+class DistanceMatrixTests(SimpleTestCase):
+    locations = [GLASGOW, EDINBURGH]
+
+    def solver_with_table(self, distances, durations):
+        solver = make_solver()
+        solver.request_osrm_matrix = mock.Mock(return_value=(
+            np.array(distances, dtype=np.float64), np.array(durations, dtype=np.float64),
+        ))
+        return solver
+
+    def test_complete_table_skips_the_estimate(self):
+        solver = self.solver_with_table([[0, 70000.7], [70100, 0]], [[0, 3600], [3650, 0]])
+        with mock.patch.object(solver, 'estimate_matrix') as estimate:
+            distances, durations = solver.get_distance_matrix(self.locations)
+        estimate.assert_not_called()
+        self.assertEqual(solver.matrix_source, 'osrm')
+        self.assertEqual(distances.tolist(), [[0, 70000], [70100, 0]])
+        self.assertEqual(durations.tolist(), [[0, 3600], [3650, 0]])
+
+    def test_unroutable_cells_come_from_the_estimate(self):
+        solver = self.solver_with_table([[0, None], [70100, 0]], [[0, None], [3650, 0]])
+        estimated_distances, estimated_durations = solver.estimate_matrix(self.locations)
+        with self.assertLogs('', 'WARNING'):
+            distances, durations = solver.get_distance_matrix(self.locations)
+        self.assertEqual(distances.tolist(), [[0, estimated_distances[0][1]], [70100, 0]])
+        self.assertEqual(durations.tolist(), [[0, estimated_durations[0][1]], [3650, 0]])
+
+    def test_unreachable_osrm_uses_the_estimate(self):
+        solver = make_solver()
+        solver.osrm_unreachable = True
+        with self.assertLogs('', 'WARNING'):
+            distances, _ = solver.get_distance_matrix(self.locations)
+        self.assertEqual(solver.matrix_source, 'haversine')
+        self.assertEqual(distances.tolist(), solver.estimate_matrix(self.locations)[0].tolist())
+
+
+class FakeSnapCollection:
+    def __init__(self, records=()):
+        self.records = {record['_id']: dict(record) for record in records}
+        self.finds = 0
+        self.writes = []
+
+    def find(self, query):
+        self.finds += 1
+        return [dict(self.records[record_id]) for record_id in query['_id']['$in'] if record_id in self.records]
+
+    def bulk_write(self, operations, ordered=True):
+        self.writes.extend(operations)
+
+
+def snap_record(location, snap_distance_m=12):
+    latitude, longitude = location
+    return {
+        'latitude': latitude,
+        'longitude': longitude,
+        'snapped_latitude': latitude + 0.0001,
+        'snapped_longitude': longitude,
+        'snap_distance_m': snap_distance_m,
+    }
+
+
+class RoadSnappingTests(SimpleTestCase):
+    depot = (55.84869, -4.21531)
+    customer_id_to_index = {'c1': 1, 'c2': 2}
+
+    def setUp(self):
+        vrp_service._snap_cache.clear()
+        self.collection = FakeSnapCollection()
+        patcher = mock.patch.object(vrp_service, 'customer_snaps', self.collection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(vrp_service._snap_cache.clear)
+        self.locations = [self.depot, (55.86, -4.25), (55.87, -4.26)]
+
+    def snap(self, nearest=snap_record, locations=None):
+        solver = make_solver()
+        solver.request_osrm_nearest = mock.Mock(side_effect=nearest)
+        snapped = solver.snap_locations(self.customer_id_to_index, locations or self.locations)
+        return solver, snapped
+
+    def test_new_customers_are_snapped_and_stored(self):
+        solver, snapped = self.snap()
+        self.assertEqual(solver.request_osrm_nearest.call_count, 2)
+        self.assertEqual(snapped, [self.depot, (55.8601, -4.25), (55.8701, -4.26)])
+        self.assertEqual(self.collection.writes, [
+            ReplaceOne({'_id': 'c1'}, snap_record(self.locations[1]), upsert=True),
+            ReplaceOne({'_id': 'c2'}, snap_record(self.locations[2]), upsert=True),
+        ])
+        self.assertFalse(solver.osrm_unreachable)
+
+    def test_snaps_are_reused_from_memory(self):
+        self.snap()
+        solver, snapped = self.snap()
+        solver.request_osrm_nearest.assert_not_called()
+        # every customer was in the in-process cache, so mongo was not asked either
+        self.assertEqual(self.collection.finds, 1)
+        self.assertEqual(snapped[1], (55.8601, -4.25))
+
+    def test_snaps_are_reused_from_mongo(self):
+        self.collection.records = {
+            'c1': {'_id': 'c1', **snap_record(self.locations[1])},
+            'c2': {'_id': 'c2', **snap_record(self.locations[2])},
+        }
+        solver, snapped = self.snap()
+        solver.request_osrm_nearest.assert_not_called()
+        self.assertEqual(self.collection.writes, [])
+        self.assertEqual(snapped[2], (55.8701, -4.26))
+        self.assertIn('c1', vrp_service._snap_cache)
+
+    def test_moved_pin_is_snapped_again(self):
+        self.snap()
+        moved = [self.depot, (55.90, -4.30), self.locations[2]]
+        solver, snapped = self.snap(locations=moved)
+        solver.request_osrm_nearest.assert_called_once_with((55.90, -4.30))
+        self.assertEqual(snapped[1], (55.9001, -4.30))
+        self.assertEqual(self.collection.writes[-1], ReplaceOne({'_id': 'c1'}, snap_record(moved[1]), upsert=True))
+
+    def test_far_snaps_are_reported(self):
+        def nearest(location):
+            return snap_record(location, snap_distance_m=900 if location == self.locations[2] else 12)
+
+        with self.assertLogs('', 'WARNING'):
+            solver, _ = self.snap(nearest)
+        self.assertEqual(solver.suspicious_snaps, [{'customer_id': 'c2', 'snap_distance_m': 900}])
+
+    def test_osrm_is_unreachable_when_every_snap_fails(self):
+        with self.assertLogs('', 'WARNING'):
+            solver, snapped = self.snap(ConnectionError("connection refused"))
+        self.assertTrue(solver.osrm_unreachable)
+        self.assertEqual(snapped, self.locations)
+        self.assertEqual(self.collection.writes, [])
+
+    def test_one_failed_snap_keeps_its_raw_location(self):
+        def nearest(location):
+            if location == self.locations[1]:
+                raise ValueError("Missing waypoint from osrm nearest response")
+            return snap_record(location)
+
+        with self.assertLogs('', 'WARNING'):
+            solver, snapped = self.snap(nearest)
+        self.assertFalse(solver.osrm_unreachable)
+        self.assertEqual(snapped, [self.depot, self.locations[1], (55.8701, -4.26)])
+
+
+class ConcurrentLoadingTests(SimpleTestCase):
+    delay = 0.1
+
+    def setUp(self):
+        vrp_service._snap_cache.clear()
+        self.addCleanup(vrp_service._snap_cache.clear)
+        patcher = mock.patch.object(vrp_service, 'customer_snaps', FakeSnapCollection())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def slow(self, value):
+        def fetch(*args):
+            time.sleep(self.delay)
+            return value
+        return fetch
+
+    def make_loading_solver(self):
+        customers = {
+            'c1': {'_id': 'c1', 'customer_name': 'Near', 'latitude': 55.86, 'longitude': -4.25},
+            'c2': {'_id': 'c2', 'customer_name': 'Cancelled', 'latitude': 55.87, 'longitude': -4.26},
+        }
+        solver = make_solver()
+        solver.fetch_invoices = self.slow([
+            {'_id': 'o1', 'customer': 'c1', 'ot_date': 'today', 'items': [{'weight_kg': 2, 'quantity': 3}]},
+            {'_id': 'o2', 'customer': 'c2', 'ot_date': 'today', 'items': []},
+        ])
+        solver.fetch_cancelled_set = self.slow({('c2', 'today')})
+        solver.fetch_vehicles = self.slow([{'_id': 'v1', 'name': 'Van', 'capacity': 500, 'status': 'available'}])
+        solver.fetch_customers = self.slow(customers)
+        solver.fetch_snap_records = self.slow({})
+
+        def nearest(location):
+            time.sleep(self.delay)
+            return snap_record(location)
+
+        solver.request_osrm_nearest = mock.Mock(side_effect=nearest)
+        solver.request_osrm_matrix = mock.Mock(return_value=(
+            np.array([[0, 3000], [3000, 0]], dtype=np.float64), np.array([[0, 300], [300, 0]], dtype=np.float64),
+        ))
+        return solver
+
+    def overlaps(self, timings, first, second):
+        first_started, first_finished = timings[first]
+        second_started, second_finished = timings[second]
+        return first_started < second_finished and second_started < first_finished
+
+    def test_stages_overlap(self):
+        solver = self.make_loading_solver()
+        vrp_data = solver.get_orders_for_routing()
+        timings = solver.stage_timings
+
+        self.assertTrue(self.overlaps(timings, 'invoices', 'vehicles'))
+        self.assertTrue(self.overlaps(timings, 'invoices', 'cancelled_invoices'))
+        self.assertTrue(self.overlaps(timings, 'customers', 'snap_records'))
+        self.assertLess(timings['road_snapping'][0], timings['osrm_table'][0])
+        wall = max(finished for _, finished in timings.values())
+        self.assertLess(wall, sum(finished - started for started, finished in timings.values()))
+
+        # only customers with a live order are snapped
+        solver.request_osrm_nearest.assert_called_once_with((55.86, -4.25))
+        self.assertEqual(vrp_data['locations'][1], (55.86, -4.25))
+        self.assertEqual(vrp_data['demand'], [0, 6])
+        self.assertEqual(vrp_data['distance_matrix'].tolist(), [[0, 3000], [3000, 0]])
+
+    def test_stage_timings_are_logged(self):
+        solver = self.make_loading_solver()
+        with self.assertLogs(vrp_service.logger, 'INFO') as logs:
+            solver.get_orders_for_routing()
+        self.assertTrue(any('stage road_snapping' in line for line in logs.output))
+        self.assertTrue(any('wall clock' in line for line in logs.output))
+
+
+class HttpHelperTests(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def test_parse_page_defaults_and_caps_page_size(self):
+        self.assertEqual(parse_page(self.factory.get('/')), (1, 20))
+        self.assertEqual(parse_page(self.factory.get('/', {'page': 3, 'page_size': 500})), (3, 100))
+
+    def test_parse_page_rejects_bad_values(self):
+        for params in ({'page': 'two'}, {'page': 0}, {'page_size': -1}):
+            with self.assertRaises(ValueError):
+                parse_page(self.factory.get('/', params))
+
+    def test_paginate_and_project(self):
+        page = paginate(list(range(5)), 2, 2)
+        self.assertEqual(page, {'results': [2, 3], 'page': 2, 'page_size': 2, 'has_next': True})
+        self.assertFalse(paginate(list(range(5)), 3, 2)['has_next'])
+        self.assertEqual(project({'a': 1, 'b': 2}, ['b', 'missing']), {'b': 2})
+        self.assertEqual(project({'a': 1}, None), {'a': 1})
+
+    def test_etag_round_trip_returns_not_modified(self):
+        payload = {'solution_id': 'SOL_1', 'vehicle_id': ObjectId('659419c572707b2a064b1788')}
+        response = etag_json_response(self.factory.get('/'), payload)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        etag = response['ETag']
+
+        for if_none_match in (etag, f"W/{etag}", f'"stale", {etag}', '*'):
+            cached = etag_json_response(self.factory.get('/', HTTP_IF_NONE_MATCH=if_none_match), payload)
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached['ETag'], etag)
+            self.assertEqual(cached.content, b'')
+
+    def test_etag_changes_with_payload(self):
+        etag = etag_json_response(self.factory.get('/'), {'page': 1})['ETag']
+        response = etag_json_response(self.factory.get('/', HTTP_IF_NONE_MATCH=etag), {'page': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class SolutionRenderTests(SimpleTestCase):
+    customer_id = ObjectId('65f0c0ffee0000000000beef')
+
+    def compact_solution(self):
+        return {
+            'solution_id': 'SOL_20261019080000',
+            'format_version': SOLUTION_FORMAT_VERSION,
+            'total_distance_m': 16000,
+            'depot_location': [55.84869, -4.21531],
+            'vehicle_routes': [{
+                'vehicle_id': 'van-1',
+                'zone': 'Zone - 1',
+                'distance_m': 16000,
+                'total_weight_kg': 12,
+                'stops': [
+                    {'type': 'depot', 'arrival_s': 0, 'departure_s': 53400, 'travel_s': 0, 'distance_m': 0},
+                    {'type': 'delivery', 'order_id': 'order-1', 'original_order_ids': ['order-1'],
+                     'customer_id': self.customer_id, 'order_weight': 12,
+                     'arrival_s': 54000, 'departure_s': 54600, 'travel_s': 4500, 'distance_m': 8000},
+                    {'type': 'depot', 'arrival_s': 59100, 'departure_s': 59100, 'travel_s': 4500, 'distance_m': 8000},
+                ],
+            }],
+        }
+
+    def test_render_compact_solution(self):
+        customers = {str(self.customer_id): {
+            'customer_name': 'Spice Shop', 'address': '1 High St', 'latitude': 55.86, 'longitude': -4.25,
+        }}
+        rendered = render_solution(self.compact_solution(), customers)
+        self.assertNotIn('format_version', rendered)
+        self.assertNotIn('depot_location', rendered)
+        self.assertEqual(rendered['total_distance'], 10.0)
+
+        route = rendered['vehicle_routes'][0]
+        self.assertEqual(route['distance_veh_km'], 10.0)
+        self.assertEqual(route['total_weight_kg_veh'], 12)
+        depot, delivery, _ = route['stops']
+        self.assertEqual(depot['location'], '55.84869,-4.21531')
+        self.assertEqual(depot['address'], 'Depot Location')
+        # seconds_to_time pads the hour with a space, as the stored strings always did
+        self.assertEqual(delivery, {
+            'type': 'delivery',
+            'arrival_time': ' 15:00',
+            'departure_time': ' 15:10',
+            'travel_time': '1h 15m',
+            'distance': 5.0,
+            'order_id': 'order-1',
+            'original_order_ids': ['order-1'],
+            'customer_id': self.customer_id,
+            'customer_name': 'Spice Shop',
+            'address': '1 High St',
+            'location': '55.86,-4.25',
+            'order_weight': 12,
+        })
+
+    def test_preformatted_stops_and_legacy_solutions_pass_through(self):
+        office_stop = {'type': 'depot', 'arrival_time': '00:00', 'travel_time': '0min', 'distance': 0}
+        solution = self.compact_solution()
+        solution['vehicle_routes'][0]['stops'] = [office_stop]
+        self.assertEqual(render_solution(solution, {})['vehicle_routes'][0]['stops'], [office_stop])
+
+        legacy = {'solution_id': 'SOL_1', 'total_distance': 3.5, 'vehicle_routes': []}
+        self.assertIs(render_solution(legacy), legacy)
+
+    def test_stored_projection(self):
+        self.assertIsNone(stored_projection(None))
+        self.assertEqual(stored_projection(['solution_id', 'total_distance', 'vehicle_routes']), {
+            'format_version': 1,
+            'solution_id': 1,
+            'total_distance': 1,
+            'total_distance_m': 1,
+            'vehicle_routes': 1,
+            'depot_location': 1,
+        })
+
+
+class TrafficSlotTests(SimpleTestCase):
+    slots = [{'start': '00:00'}, {'start': '16:00', 'duration_factor': 1.5}, {'start': '19:00', 'osrm_url': 'http://osrm-evening'}]
+
+    def test_slot_for(self):
+        starts = slot_starts([{'start': '06:00'}, {'start': '16:00'}, {'start': '19:00'}])
+        self.assertEqual(starts, [21600, 57600, 68400])
+        self.assertEqual(slot_for(57599, starts), 0)
+        self.assertEqual(slot_for(57600, starts), 1)
+        self.assertEqual(slot_for(80000, starts), 2)
+        # before the first slot, and past midnight, still belong to the evening slot
+        self.assertEqual(slot_for(3600, starts), 2)
+        self.assertEqual(slot_for(86400 + 3600, starts), 2)
+
+    def test_to_minutes_rounds_up_and_clips(self):
+        minutes = to_minutes([[0, 1, 60], [61, 119, 10**7]])
+        self.assertEqual(minutes.dtype, np.int16)
+        self.assertEqual(minutes.tolist(), [[0, 1, 1], [2, 2, 32767]])
+
+    def test_build_slot_matrices(self):
+        profile = to_minutes([[0, 600], [600, 0]])
+        sources, matrices = build_slot_matrices(self.slots, {'http://osrm-evening': profile})
+        self.assertEqual(sources, [('scale', 1.0), ('scale', 1.5), ('matrix', 0)])
+        self.assertEqual(matrices.tolist(), [profile.tolist()])
+
+    def test_missing_profile_falls_back_to_scaling(self):
+        with self.assertLogs(traffic.logger, 'WARNING'):
+            sources, matrices = build_slot_matrices(self.slots, {})
+        self.assertEqual(sources, [('scale', 1.0), ('scale', 1.5), ('scale', 1.0)])
+        self.assertIsNone(matrices)
+
+    @override_settings(TRAVEL_TIME_SLOTS=slots)
+    def test_profiles_are_not_fetched_after_fallback(self):
+        solver = make_solver()
+        solver.matrix_source = 'haversine'
+        with self.assertLogs(traffic.logger, 'WARNING'):
+            starts, sources, matrices = solver.get_time_slots([(12.5, 13.5), (12.6, 13.6)], [[0, 60], [60, 0]])
+        self.assertEqual(starts, [0, 57600, 68400])
+        self.assertEqual(sources[2], ('scale', 1.0))
+        self.assertIsNone(matrices)
+
+
+class DropPenaltyTests(SimpleTestCase):
+    def test_default_tiers_scale_with_the_longest_arc(self):
+        solver = make_solver()
+        self.assertEqual(solver.drop_penalty(1000, 5000), 5_000_000)
+        self.assertEqual(solver.drop_penalty(999, 5000), 500_000)
+        self.assertEqual(solver.drop_penalty(100, 5000), 500_000)
+        self.assertEqual(solver.drop_penalty(0, 5000), 50_000)
+
+    def test_unparseable_priority_uses_the_lowest_tier(self):
+        solver = make_solver()
+        for raw_priority in (None, 'urgent', -5):
+            self.assertEqual(solver.drop_penalty(raw_priority, 5000), 50_000)
+        self.assertEqual(solver.drop_penalty('100', 5000), 500_000)
+
+    def test_every_tier_outweighs_serving_the_stop(self):
+        solver = make_solver()
+        max_arc_cost = 65000
+        self.assertTrue(all(solver.drop_penalty(priority, max_arc_cost) > max_arc_cost for priority in (0, 100, 1000)))
+
+    @override_settings(SOLVER_DROP_PENALTY_TIERS=[[0, 2], [50, 20]])
+    def test_tiers_from_settings_are_ordered_by_threshold(self):
+        solver = make_solver()
+        self.assertEqual(solver.drop_penalty(60, 10), 200)
+        self.assertEqual(solver.drop_penalty(10, 10), 20)
+
+
+@override_settings(SOLVER_POOL_SIZE=1, SOLVER_POOL_IDLE_TIMEOUT_SECONDS=0, SOLVER_POOL_RESULT_TIMEOUT_SECONDS=30)
+class SolverPoolTests(SimpleTestCase):
+    def setUp(self):
+        # every test starts with its own warm worker
+        solver_pool.get_pool().submit(solver_pool._ready).result(timeout=60)
+        self.pool = solver_pool._pool
+
+    def tearDown(self):
+        pool = solver_pool._pool
+        solver_pool._forget_parent_pool()
+        for stale in {pool, self.pool} - {None}:
+            stale.shutdown(wait=False, cancel_futures=True)
+
+    def test_matrices_round_trip_through_shared_memory(self):
+        released = []
+        release = solver_pool._release
+
+        def record_release(blocks):
+            released.extend(block.name for block in blocks)
+            release(blocks)
+
+        slot_matrices = np.array([[[0, 2], [3, 0]]], dtype=np.int16)
+        with mock.patch.object(solver_pool, '_release', record_release):
+            result = solver_pool.solve(StubSolver(), [[0, 5], [6, 0]], [[0, 7], [8, 0]], slot_matrices, depot_index=0)
+        self.assertNotEqual(result['pid'], os.getpid())
+        self.assertEqual(result['distance_matrix'], [[0, 5], [6, 0]])
+        self.assertEqual(result['time_matrix'], [[0, 7], [8, 0]])
+        self.assertEqual(result['slot_matrices'], [[[0, 2], [3, 0]]])
+        self.assertEqual(result['inputs'], {'depot_index': 0})
+        self.assertEqual(len(released), 3)
+        for name in released:
+            with self.assertRaises(FileNotFoundError):
+                shared_memory.SharedMemory(name=name)
+
+    @override_settings(SOLVER_POOL_SIZE=0)
+    def test_pool_size_zero_solves_in_process(self):
+        result = solver_pool.solve(StubSolver(), [[0]], [[0]], slot_matrices=np.zeros((1, 1, 1), dtype=np.int16))
+        self.assertEqual(result['pid'], os.getpid())
+        self.assertEqual(result['slot_matrices'], [[[0]]])
+
+    @override_settings(SOLVER_POOL_RESULT_TIMEOUT_SECONDS=1.2)
+    def test_queued_plans_do_not_time_out(self):
+        # four 0.5s plans on one worker: the last one waits 1.5s, longer than the timeout
+        with ThreadPoolExecutor(max_workers=4) as requests:
+            results = list(requests.map(
+                lambda _: solver_pool.solve(StubSolver(delay=0.5), [[0]], [[0]]), range(4)))
+        self.assertTrue(all(result['pid'] != os.getpid() for result in results))
+        self.assertIs(solver_pool._pool, self.pool)
+
+    @override_settings(SOLVER_POOL_RESULT_TIMEOUT_SECONDS=0.5)
+    def test_stuck_worker_fails_the_plan_and_replaces_the_pool(self):
+        started = time.monotonic()
+        with self.assertLogs(solver_pool.logger, 'ERROR'), self.assertRaises(TimeoutError):
+            solver_pool.solve(StubSolver(delay=3), [[0]], [[0]])
+        # the plan is not solved a second time in process
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIsNone(solver_pool._pool)
+
+    def test_broken_pool_falls_back_in_process(self):
+        with self.assertLogs(solver_pool.logger, 'ERROR'):
+            result = solver_pool.solve(StubSolver(crash_in_worker=True), [[0]], [[0]])
+        self.assertEqual(result['pid'], os.getpid())
+        self.assertIsNone(solver_pool._pool)
+        self.assertNotEqual(solver_pool.solve(StubSolver(), [[0]], [[0]])['pid'], os.getpid())
+
+    def test_forked_child_forgets_the_parent_pool(self):
+        child = os.fork()
+        if child == 0:
+            os._exit(0 if solver_pool._pool is None and solver_pool._slots is None else 1)
+        _, status = os.waitpid(child, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(solver_pool._pool, self.pool)
+
+    def test_pool_is_rebuilt_for_a_new_pid(self):
+        solver_pool._pool_pid = -1
+        self.assertIsNot(solver_pool.get_pool(), self.pool)
+        self.assertEqual(solver_pool._pool_pid, os.getpid())
+
+    def test_idle_pool_is_recycled_once(self):
+        self.assertFalse(solver_pool._recycle_if_idle(60))
+        solver_pool._last_used -= 120
+        self.assertTrue(solver_pool._recycle_if_idle(60))
+        self.assertIsNot(solver_pool._pool, self.pool)
+        # a fresh pool is not recycled again until a solve has used it
+        solver_pool._last_used -= 120
+        self.assertFalse(solver_pool._recycle_if_idle(60))
+
+
+@override_settings(MONGO_RETRY_BACKOFF_SECONDS=60)
+class MongoConnectionTests(SimpleTestCase):
+    def setUp(self):
+        self.state = (db._client, db._db, db._last_failure)
+        db._client, db._db, db._last_failure = None, None, None
+
+    def tearDown(self):
+        db._client, db._db, db._last_failure = self.state
+
+    def test_connects_once(self):
+        def connect():
+            db._db = {'orders': 'collection'}
+            return db._db
+
+        with mock.patch.object(db, '_connect', side_effect=connect) as connect_mock:
+            self.assertEqual(get_mongo_connection(), {'orders': 'collection'})
+            self.assertEqual(get_mongo_connection(), {'orders': 'collection'})
+        self.assertEqual(connect_mock.call_count, 1)
+        self.assertIsNone(db._last_failure)
+
+    def test_failure_is_remembered_for_the_backoff(self):
+        with mock.patch.object(db, '_connect', side_effect=ConnectionError("database timeout")) as connect:
+            for _ in range(3):
+                with self.assertRaisesMessage(ConnectionError, "database timeout"):
+                    get_mongo_connection()
+            self.assertEqual(connect.call_count, 1)
+
+            # once the backoff has passed the next caller probes again
+            db._last_failure = (db._last_failure[0] - 61, db._last_failure[1])
+            with self.assertRaises(ConnectionError):
+                get_mongo_connection()
+            self.assertEqual(connect.call_count, 2)
+
+    def test_only_one_caller_probes_after_a_failure(self):
+        db._last_failure = (time.monotonic() - 61, "database timeout")
+        with db._lock, mock.patch.object(db, '_connect') as connect:
+            with self.assertRaisesMessage(ConnectionError, "database timeout"):
+                get_mongo_connection()
+        connect.assert_not_called()
+
+    def test_probe_succeeding_while_another_caller_gives_up(self):
+        class ProberFinishes:
+            # the prober clears the failure between the caller's check and its acquire
+            def acquire(self, blocking=True):
+                db._last_failure = None
+                return False
+
+        db._last_failure = (time.monotonic() - 61, "database timeout")
+        with mock.patch.object(db, '_lock', ProberFinishes()):
+            with self.assertRaisesMessage(ConnectionError, "database timeout"):
+                get_mongo_connection()
+
+    def test_lazy_collection_connects_on_first_use(self):
+        with mock.patch.object(db, 'get_mongo_connection') as connect:
+            orders = LazyCollection('orders')
+            connect.assert_not_called()
+            orders.find_one({'_id': 1})
+        connect.return_value.__getitem__.assert_called_once_with('orders')
+        connect.return_value['orders'].find_one.assert_called_once_with({'_id': 1})
+        self.assertEqual(repr(orders), "LazyCollection('orders')")
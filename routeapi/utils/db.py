@@ -1,5 +1,6 @@
 from django.conf import settings
 from pymongo import MongoClient
+import pymongo
 from pymongo.errors import (
     ConnectionFailure,
     ConfigurationError,
@@ -8,19 +9,61 @@ from pymongo.errors import (
     AutoReconnect,
 )
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 _client = None
 _db = None
+_lock = threading.Lock()
+_last_failure = None
+
+def _recent_failure():
+    failure = _last_failure
+    if failure is not None and time.monotonic() - failure[0] < settings.MONGO_RETRY_BACKOFF_SECONDS:
+        return failure[1]
+    return None
 
 def get_mongo_connection():
-    global _client, _db
+    global _last_failure
     if _db is not None:
         return _db
+    reason = _recent_failure()
+    if reason:
+        raise ConnectionError(reason)
+    # while mongo is known to be down only one caller probes it, the rest fail fast.
+    # read once: the prober may clear _last_failure before our acquire gives up
+    failure = _last_failure
+    if not _lock.acquire(blocking=failure is None):
+        raise ConnectionError(failure[1])
+    try:
+        if _db is not None:
+            return _db
+        reason = _recent_failure()
+        if reason:
+            raise ConnectionError(reason)
+        try:
+            db = _connect()
+        except Exception as e:
+            _last_failure = (time.monotonic(), str(e) or "database unavailable")
+            raise
+        _last_failure = None
+        return db
+    finally:
+        _lock.release()
+
+def _connect():
+    global _client, _db
     try:
         _client=MongoClient(
             settings.MONGO_URI,
-            serverSelectionTimeoutMS= settings.MONGO_CONNECTION_TIMEOUT_MS
+            serverSelectionTimeoutMS= settings.MONGO_CONNECTION_TIMEOUT_MS,
+            connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+            socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS,
+            maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+            minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+            maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
         )
         _client.server_info()
         _db = _client[settings.MONGO_DB_NAME]
@@ -55,4 +98,20 @@ def _close_connection():
             except Exception as e:
                 logger.warning(f"error closing connection: {e}")
             _client =None
-            _db=None
\ No newline at end of file
+            _db=None
+
+def ping_mongo():
+    # bounded by its own budget so readiness probes answer before their own timeout
+    with pymongo.timeout(settings.MONGO_PING_TIMEOUT_MS / 1000):
+        get_mongo_connection().command('ping')
+
+class LazyCollection:
+    # resolves the collection on first attribute access so importing models never connects
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(get_mongo_connection()[self._name], attr)
+
+    def __repr__(self):
+        return f"LazyCollection({self._name!r})"
@@ -0,0 +1,31 @@
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def great_circle_matrix(locations):
+    # locations are (lat, lon) pairs, result is an n x n array in metres
+    coords = np.radians(np.asarray(locations, dtype=np.float64).reshape(-1, 2))
+    lat = coords[:, 0]
+    lon = coords[:, 1]
+    return _haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+
+
+def great_circle_from(origin, locations):
+    coords = np.radians(np.asarray(locations, dtype=np.float64).reshape(-1, 2))
+    lat0, lon0 = np.radians(np.asarray(origin, dtype=np.float64))
+    return _haversine(lat0, lon0, coords[:, 0], coords[:, 1])
+
+
+def estimate_road_matrices(locations, circuity_factor, average_speed_kmh):
+    # int64 arrays; callers convert to lists only where cells are read one at a time
+    road_distance = great_circle_matrix(locations) * float(circuity_factor)
+    duration = road_distance / (float(average_speed_kmh) / 3.6)
+    return np.rint(road_distance).astype(np.int64), np.rint(duration).astype(np.int64)
@@ -0,0 +1,21 @@
+from django.http import JsonResponse
+from .utils.db import ping_mongo
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def health_live(request):
+    return JsonResponse({"status": "ok"})
+
+
+def health_ready(request):
+    started = time.perf_counter()
+    try:
+        ping_mongo()
+    except Exception as e:
+        logger.warning(f"readiness check failed: {e}")
+        return JsonResponse({"status": "unavailable", "mongo": "down"}, status=503)
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    return JsonResponse({"status": "ok", "mongo": "up", "latency_ms": latency_ms})
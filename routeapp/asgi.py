@@ -14,3 +14,9 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'routeapp.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings
+
+if settings.SOLVER_POOL_PREWARM:
+    from routeapi.routesolver.solver_pool import prewarm
+    prewarm()
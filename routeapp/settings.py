@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import json
 from decouple import config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -146,3 +147,35 @@ CSRF_TRUSTED_ORIGINS = [
 MONGO_URI = config('MONGO_URI')
 MONGO_DB_NAME = config("MONGO_DB_NAME")
 MONGO_CONNECTION_TIMEOUT_MS = config('MONGO_CONNECTION_TIMEOUT_MS', cast=int, default=5000)
+MONGO_CONNECT_TIMEOUT_MS = config('MONGO_CONNECT_TIMEOUT_MS', cast=int, default=5000)
+MONGO_SOCKET_TIMEOUT_MS = config('MONGO_SOCKET_TIMEOUT_MS', cast=int, default=60000)
+MONGO_MAX_POOL_SIZE = config('MONGO_MAX_POOL_SIZE', cast=int, default=50)
+MONGO_MIN_POOL_SIZE = config('MONGO_MIN_POOL_SIZE', cast=int, default=0)
+MONGO_MAX_IDLE_TIME_MS = config('MONGO_MAX_IDLE_TIME_MS', cast=int, default=300000)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = config('MONGO_WAIT_QUEUE_TIMEOUT_MS', cast=int, default=10000)
+MONGO_RETRY_BACKOFF_SECONDS = config('MONGO_RETRY_BACKOFF_SECONDS', cast=float, default=5.0)
+MONGO_PING_TIMEOUT_MS = config('MONGO_PING_TIMEOUT_MS', cast=int, default=1000)
+
+OSRM_URL = config('OSRM_URL', default='http://localhost:6000')
+OSRM_TIMEOUT_SECONDS = config('OSRM_TIMEOUT_SECONDS', cast=float, default=10.0)
+OSRM_MAX_SNAP_DISTANCE_M = config('OSRM_MAX_SNAP_DISTANCE_M', cast=int, default=200)
+HAVERSINE_CIRCUITY_FACTOR = config('HAVERSINE_CIRCUITY_FACTOR', cast=float, default=1.3)
+HAVERSINE_AVERAGE_SPEED_KMH = config('HAVERSINE_AVERAGE_SPEED_KMH', cast=float, default=40.0)
+# time-of-day travel slots, e.g. [{"start": "00:00"}, {"start": "16:00", "duration_factor": 1.3},
+# {"start": "19:00", "osrm_url": "http://localhost:6001"}]; empty uses the single OSRM matrix all day
+TRAVEL_TIME_SLOTS = config('TRAVEL_TIME_SLOTS', cast=json.loads, default='[]')
+
+SOLVER_POOL_SIZE = config('SOLVER_POOL_SIZE', cast=int, default=2)
+SOLVER_POOL_PREWARM = config('SOLVER_POOL_PREWARM', cast=bool, default=True)
+SOLVER_POOL_IDLE_TIMEOUT_SECONDS = config('SOLVER_POOL_IDLE_TIMEOUT_SECONDS', cast=int, default=900)
+SOLVER_POOL_MAX_TASKS_PER_CHILD = config('SOLVER_POOL_MAX_TASKS_PER_CHILD', cast=int, default=50)
+# bounds a solve once a worker has picked it up and must exceed the solver time limit;
+# a worker that misses it is replaced along with its pool and the plan fails
+SOLVER_POOL_RESULT_TIMEOUT_SECONDS = config('SOLVER_POOL_RESULT_TIMEOUT_SECONDS', cast=int, default=120)
+
+# [min priority_value, multiple of the largest arc cost] charged for dropping an order
+SOLVER_DROP_PENALTY_TIERS = config('SOLVER_DROP_PENALTY_TIERS', cast=json.loads, default='[[1000, 1000], [100, 100], [0, 10]]')
+SOLVER_VEHICLE_FIXED_COST = config('SOLVER_VEHICLE_FIXED_COST', cast=int, default=0)
+# a non-zero cost turns time window ends into soft bounds, late by at most SOLVER_MAX_LATENESS_SECONDS
+SOLVER_LATENESS_COST_PER_SECOND = config('SOLVER_LATENESS_COST_PER_SECOND', cast=int, default=0)
+SOLVER_MAX_LATENESS_SECONDS = config('SOLVER_MAX_LATENESS_SECONDS', cast=int, default=1800)
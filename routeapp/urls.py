@@ -16,8 +16,11 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path,include
+from routeapi.views import health_live, health_ready
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/routes/', include("routeapi.routesolver.urls")),
+    path('api/v1/health/live/', health_live),
+    path('api/v1/health/ready/', health_ready),
 ]